@@ -0,0 +1,231 @@
+# Copyright (c) 2022-2024, NVIDIA CORPORATION & AFFILIATES. All rights reserved.
+#
+# See LICENSE for license information.
+
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pytest
+import torch
+
+from transformer_engine.pytorch import LayerNormLinear, get_cpu_offload_context
+from transformer_engine.pytorch.cpu_offload import (
+    CpuOffloadHookWithOffloadHandler,
+    SynchronizedGroupOffloadHandler,
+    group_prefetch_offload_commit,
+)
+from transformer_engine.pytorch.fp8 import fp8_autocast, FP8GlobalStateManager
+
+# Check if FP8 is supported
+fp8_available, reason_for_no_fp8 = FP8GlobalStateManager.is_fp8_available()
+
+# Model configuration, every layer is a group, the last one is not offloaded
+NUM_LAYERS = 4
+SEQ_LEN = 64
+BATCH_SIZE = 2
+HIDDEN_SIZE = 256
+
+
+class _SquareSavingTwoViews(torch.autograd.Function):
+    """Square a tensor, saving two identical views of it for backward"""
+
+    @staticmethod
+    def forward(ctx, inp: torch.Tensor) -> torch.Tensor:
+        inp_2d = inp.view(-1, inp.size(-1))
+        inp_2d_again = inp.view(-1, inp.size(-1))
+        inp_2d.activation_offloading = True
+        inp_2d_again.activation_offloading = True
+        ctx.save_for_backward(inp_2d, inp_2d_again)
+        return inp * inp
+
+    @staticmethod
+    def backward(ctx, grad_output: torch.Tensor) -> Tuple[torch.Tensor]:
+        inp_2d, inp_2d_again = ctx.saved_tensors
+        return grad_output * (inp_2d + inp_2d_again).view(grad_output.size())
+
+
+class _ScaleByCPUScalar(torch.autograd.Function):
+    """Scale a tensor by a 0-dim CPU tensor, saving the CPU tensor for backward"""
+
+    @staticmethod
+    def forward(ctx, inp: torch.Tensor, scale: torch.Tensor) -> torch.Tensor:
+        ctx.save_for_backward(scale)
+        return inp * scale
+
+    @staticmethod
+    def backward(ctx, grad_output: torch.Tensor) -> Tuple[torch.Tensor, None]:
+        (scale,) = ctx.saved_tensors
+        return grad_output * scale, None
+
+
+class _Layer(torch.nn.Module):
+    def __init__(self, save_two_views: bool, save_cpu_scalar: bool) -> None:
+        super().__init__()
+        self.linear = LayerNormLinear(HIDDEN_SIZE, HIDDEN_SIZE)
+        self.save_two_views = save_two_views
+        self.save_cpu_scalar = save_cpu_scalar
+
+    def forward(self, inp: torch.Tensor) -> torch.Tensor:
+        out = self.linear(inp)
+        if self.save_two_views:
+            out = _SquareSavingTwoViews.apply(out)
+        if self.save_cpu_scalar:
+            out = _ScaleByCPUScalar.apply(out, torch.tensor(0.5))
+        return out
+
+
+def _make_model(save_two_views: bool = False, save_cpu_scalar: bool = False) -> torch.nn.Module:
+    # Same parameters for every model
+    torch.manual_seed(1234)
+    return torch.nn.ModuleList([_Layer(save_two_views, save_cpu_scalar) for _ in range(NUM_LAYERS)])
+
+
+def _run_model(
+    model: torch.nn.Module,
+    offload_context: Any,
+    sync_function: Callable,
+    fp8: bool = False,
+    num_steps: int = 2,
+    check_states: Optional[Callable[[], None]] = None,
+) -> List[Optional[torch.Tensor]]:
+    """Run forward and backward steps, return outputs and gradients of every step"""
+    torch.manual_seed(5678)
+    results = []
+    for _ in range(num_steps):
+        inp = torch.randn(
+            (SEQ_LEN, BATCH_SIZE, HIDDEN_SIZE),
+            device="cuda",
+            requires_grad=True,
+        )
+        grad_output = torch.randn_like(inp)
+        for param in model.parameters():
+            param.grad = None
+
+        out = inp
+        with fp8_autocast(enabled=fp8):
+            for layer in model:
+                with offload_context:
+                    out = layer(out)
+                out = sync_function(out)
+        if check_states is not None:
+            check_states()
+        out.backward(grad_output)
+        torch.cuda.synchronize()
+
+        results += [out.detach(), inp.grad] + [param.grad for param in model.parameters()]
+    return results
+
+
+def _get_offloaded_states(offload_handler: SynchronizedGroupOffloadHandler, group: int) -> List:
+    """States of the saved tensors of a group that were copied to the host"""
+    states = offload_handler.tensor_group_states[group]
+    return [state for state in states if isinstance(state, tuple)]
+
+
+def _check_offloaded_states(
+    offload_handler: SynchronizedGroupOffloadHandler,
+    expect_offloaded: bool = True,
+    expect_aliases: bool = False,
+) -> None:
+    """Check which groups have offloaded saved tensors after forward"""
+    for group in range(NUM_LAYERS):
+        offloaded_states = _get_offloaded_states(offload_handler, group)
+        if expect_offloaded and group < NUM_LAYERS - 1:
+            assert offloaded_states, f"No saved tensor of group {group} was offloaded"
+            if expect_aliases:
+                # the two views saved by _SquareSavingTwoViews share one host copy
+                num_distinct_states = len({id(state) for state in offloaded_states})
+                assert num_distinct_states < len(offloaded_states), (
+                    f"No saved tensors of group {group} were de-duplicated"
+                )
+            continue
+        assert not offloaded_states, f"Saved tensors of group {group} were offloaded"
+        for state in offload_handler.tensor_group_states[group]:
+            if state.dim() > 0:
+                assert state.is_cuda, f"Saved tensor of group {group} left the device"
+
+
+def _test_cpu_offload(
+    offload_kwargs: Dict[str, Any],
+    tols: Optional[Dict[str, float]] = None,
+    save_two_views: bool = False,
+    fp8: bool = False,
+    expect_offloaded: bool = True,
+) -> None:
+    if tols is None:
+        tols = {}
+    ref = _run_model(_make_model(save_two_views), nullcontext(), lambda x: x, fp8=fp8)
+    offload_context, sync_function = get_cpu_offload_context(
+        enabled=True,
+        num_layers=NUM_LAYERS - 1,
+        **offload_kwargs,
+    )
+    offload_handler = offload_context.offload_handler
+    test = _run_model(
+        _make_model(save_two_views),
+        offload_context,
+        sync_function,
+        fp8=fp8,
+        check_states=lambda: _check_offloaded_states(
+            offload_handler,
+            expect_offloaded=expect_offloaded,
+            expect_aliases=save_two_views,
+        ),
+    )
+    for t, t_ref in zip(test, ref):
+        torch.testing.assert_close(t, t_ref, **tols)
+
+
+@pytest.mark.parametrize("save_two_views", (False, True))
+@pytest.mark.parametrize("num_prefetch_layers", (1, 2))
+def test_cpu_offload(num_prefetch_layers, save_two_views):
+    _test_cpu_offload(
+        dict(num_prefetch_layers=num_prefetch_layers, min_offload_bytes=0),
+        save_two_views=save_two_views,
+    )
+
+
+def test_cpu_offload_invalid_num_prefetch_layers():
+    with pytest.raises(ValueError):
+        get_cpu_offload_context(enabled=True, num_layers=NUM_LAYERS - 1, num_prefetch_layers=0)
+
+
+def test_cpu_offload_min_offload_bytes():
+    # with the default threshold of 1 MiB, every saved tensor of the model stays on device
+    assert SEQ_LEN * BATCH_SIZE * HIDDEN_SIZE * 4 < 1 << 20
+    _test_cpu_offload({}, expect_offloaded=False)
+
+
+def test_cpu_offload_bf16_activations():
+    _test_cpu_offload(
+        dict(activation_offload_dtype=torch.bfloat16, min_offload_bytes=0),
+        tols=dict(rtol=2e-2, atol=2e-2),
+    )
+
+
+@pytest.mark.parametrize("activation_offload_dtype", (torch.float16, torch.float32))
+def test_cpu_offload_invalid_activation_offload_dtype(activation_offload_dtype):
+    with pytest.raises(ValueError):
+        get_cpu_offload_context(
+            enabled=True,
+            num_layers=NUM_LAYERS - 1,
+            activation_offload_dtype=activation_offload_dtype,
+        )
+
+
+@pytest.mark.skipif(not fp8_available, reason=reason_for_no_fp8)
+def test_cpu_offload_fp8():
+    _test_cpu_offload(dict(min_offload_bytes=0), fp8=True)
+
+
+def test_cpu_offload_synchronized():
+    ref = _run_model(_make_model(save_cpu_scalar=True), nullcontext(), lambda x: x)
+    offload_handler = SynchronizedGroupOffloadHandler(num_offload_group=NUM_LAYERS - 1)
+    test = _run_model(
+        _make_model(save_cpu_scalar=True),
+        CpuOffloadHookWithOffloadHandler(offload_handler=offload_handler),
+        lambda x: group_prefetch_offload_commit(x, offload_handler),
+        check_states=lambda: _check_offloaded_states(offload_handler),
+    )
+    for t, t_ref in zip(test, ref):
+        torch.testing.assert_close(t, t_ref)
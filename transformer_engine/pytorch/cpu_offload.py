@@ -6,6 +6,7 @@
 from __future__ import annotations
 from contextlib import nullcontext
 from typing import Any, Dict, Optional
+import weakref
 
 import torch
 
@@ -15,6 +16,16 @@ __all__ = ["get_cpu_offload_context"]
 
 CPUOffloadEnabled = False
 
+# alignment in bytes of the tensors sharing a pinned host buffer
+_HOST_BUF_ALIGNMENT = 256
+
+
+def _record_stream(tensor: torch.Tensor, stream: torch.cuda.Stream) -> None:
+    """Mark the device memory of a tensor as in use by a side stream."""
+    if isinstance(tensor, Float8Tensor):
+        tensor = tensor._data
+    tensor.record_stream(stream)
+
 
 class CpuOffloadSavedTensorHook:
     """Contex-manager that executes a pair of pack/unpack hooks for saved tensors.
@@ -173,8 +184,9 @@ group_prefetch_offload_commit = GroupCommitFunction.apply
 
 class SynchronizedGroupOffloadHandler(OffloadHandler):
     """Offload Handler that offloads/reloads in a synchronized way.
-    The device-to-host and host-to-device copying happen in the same stream
-    as the computation kernels, thus the copying will block computation.
+    The device-to-host copying happens on a dedicated stream and overlaps with
+    computation, while the host-to-device copying blocks the computation stream
+    until the reloaded tensor is available.
     """
 
     def __init__(
@@ -186,20 +198,51 @@ class SynchronizedGroupOffloadHandler(OffloadHandler):
         self.tensor_need_offloading_checker = tensor_need_offloading_checker
         self.debug = debug
 
+        # allocate streams for device-host copies
+        self.d2h_stream = torch.cuda.Stream()
+        self.h2d_stream = torch.cuda.Stream()
+        # whether D2H copies of the live saved tensors of the group were issued
+        self.d2h_copies_pending = False
+
         self.groupid_reset()
 
     def groupid_reset(self):
         """Groupid reset."""
         # Data structures to label saved tensors and book-keep their cpu copies.
-        # Currently, on push, create a new cpu tensor and copies; on pop, copies
-        # the tensor back to gpu and deletes the cpu tensor.
+        # On push, the tensor is copied into a pinned host buffer that is reused
+        # across iterations; on pop, it is copied back into a new gpu tensor.
         # These will increment whenever `group_commit()` is invoked
         self.current_group, self.tensor_count_current_group = (0, 0)
         self.torch_tensor_count = 0
-        self.tensor_tag_to_state = {}
+        # States of saved tensors, stored in slots indexed by the tensor tag
+        # (group, index in group) to avoid hashing tags on every push and pop.
+        self.tensor_group_states = []
+        # States of tensors saved by torch tracing, with tags (-1, count)
+        self.stray_tensor_tag_to_state = {}
+        # Pinned host buffers, kept across iterations so that steady-state
+        # offloading does not go through the pinned memory allocator.
+        self.tensor_tag_to_cpu_buf = {}
+
+    def get_new_tensor_tag(self):
+        """Get unique tag for a tensor saved in the current group."""
+        if self.tensor_count_current_group == 0:
+            # first tensor of the group in this iteration
+            while len(self.tensor_group_states) <= self.current_group:
+                self.tensor_group_states.append([])
+            states = self.tensor_group_states[self.current_group]
+            assert all(state is None for state in states), "Saved tensors were never popped"
+            self.tensor_group_states[self.current_group] = []
+        tensor_tag = (self.current_group, self.tensor_count_current_group)
+        self.tensor_count_current_group += 1
+        return tensor_tag
 
     def on_group_commit_forward(self):
         """On group commit forward."""
+        if self.d2h_copies_pending:
+            # the saved tensors were copied directly, not snapshotted, and some
+            # (e.g. userbuffers outputs) are overwritten by the next group
+            torch.cuda.current_stream().wait_stream(self.d2h_stream)
+            self.d2h_copies_pending = False
         # finishing up with updating current group and tensor count
         self.current_group += 1  # increment
         self.tensor_count_current_group = 0  # reset
@@ -209,23 +252,47 @@ class SynchronizedGroupOffloadHandler(OffloadHandler):
         self.current_group -= 1
         assert self.current_group >= 0
 
+    def get_cpu_buf_for_offloaded_tensor(self, tensor, tensor_tag):
+        """Get pinned host buffer for offloaded tensor."""
+        dtype = torch.uint8 if isinstance(tensor, Float8Tensor) else tensor.dtype
+        cpu_buf = self.tensor_tag_to_cpu_buf.get(tensor_tag)
+        if cpu_buf is None or cpu_buf.size() != tensor.size() or cpu_buf.dtype != dtype:
+            # supposed to only execute once per tag
+            cpu_buf = torch.empty(
+                tensor.size(),
+                dtype=dtype,
+                layout=tensor.layout,
+                device="cpu",
+                pin_memory=True,
+            )
+            self.tensor_tag_to_cpu_buf[tensor_tag] = cpu_buf
+        return cpu_buf
+
     @staticmethod
-    def offload(src_tensor, pin_memory=True):
-        """Offload."""
+    def offload(src_tensor, pin_memory=True, cpu_buf=None):
+        """Offload.
+
+        A given `cpu_buf` is copied into, it has to be pinned if `pin_memory` is set
+        since the copy is then non-blocking.
+        """
         fp8_offload = isinstance(src_tensor, Float8Tensor)
 
-        cpu_backup = torch.empty(
-            src_tensor.size(),
-            dtype=torch.uint8 if fp8_offload else src_tensor.dtype,
-            layout=src_tensor.layout,
-            device="cpu",
-            pin_memory=pin_memory,
-        )
+        if cpu_buf is None:
+            cpu_buf = torch.empty(
+                src_tensor.size(),
+                dtype=torch.uint8 if fp8_offload else src_tensor.dtype,
+                layout=src_tensor.layout,
+                device="cpu",
+                pin_memory=pin_memory,
+            )
 
         if fp8_offload:
-            cpu_backup = Float8Tensor.make_like(src_tensor, data=cpu_backup)
-
-        cpu_backup.copy_(src_tensor, non_blocking=pin_memory)
+            # copy the raw bytes, Float8Tensor.copy_ would not pass on non_blocking
+            cpu_buf.copy_(src_tensor._data, non_blocking=pin_memory)
+            cpu_backup = Float8Tensor.make_like(src_tensor, data=cpu_buf)
+        else:
+            cpu_buf.copy_(src_tensor, non_blocking=pin_memory)
+            cpu_backup = cpu_buf
         state = (src_tensor.device, cpu_backup)
         return state
 
@@ -233,6 +300,12 @@ class SynchronizedGroupOffloadHandler(OffloadHandler):
     def reload(state, non_blocking=None):
         """Reload."""
         dev, cpu_backup = state
+        if isinstance(cpu_backup, Float8Tensor):
+            # likewise, move the raw bytes instead of going through dispatch
+            if non_blocking is None:
+                non_blocking = cpu_backup._data.is_pinned()
+            data = cpu_backup._data.to(dev, non_blocking=non_blocking)
+            return Float8Tensor.make_like(cpu_backup, data=data)
         if non_blocking is None:
             non_blocking = cpu_backup.is_pinned()
         return cpu_backup.to(dev, non_blocking=non_blocking)
@@ -240,24 +313,46 @@ class SynchronizedGroupOffloadHandler(OffloadHandler):
     def tensor_push(self, tensor: torch.Tensor, **kwargs):
         """Tensor push."""
         # obtain a unique tensor tag
-        tensor_tag = (self.current_group, self.tensor_count_current_group)
-        self.tensor_count_current_group += 1
-        assert tensor_tag not in self.tensor_tag_to_state
+        tensor_tag = self.get_new_tensor_tag()
+        states = self.tensor_group_states[self.current_group]
         if self.current_group < self.num_offload_group and self.tensor_need_offloading_checker(
             tensor
         ):
-            state = SynchronizedGroupOffloadHandler.offload(tensor)
-            self.tensor_tag_to_state[tensor_tag] = state
+            if tensor.is_cuda:
+                cpu_buf = self.get_cpu_buf_for_offloaded_tensor(tensor, tensor_tag)
+                # the copy only has to wait for the kernels that produced the tensor
+                self.d2h_stream.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(self.d2h_stream):
+                    state = SynchronizedGroupOffloadHandler.offload(tensor, cpu_buf=cpu_buf)
+                # the caching allocator must not reuse the memory before the copy is done
+                _record_stream(tensor, self.d2h_stream)
+                self.d2h_copies_pending = True
+            else:
+                # e.g. CPU scalars saved by mixed-device ops, there is nothing to overlap
+                state = SynchronizedGroupOffloadHandler.offload(tensor)
+            states.append(state)
         else:
             # will be offloaded together after group commit
-            self.tensor_tag_to_state[tensor_tag] = tensor
+            states.append(tensor)
         return tensor_tag
 
     def tensor_pop(self, tensor_tag, **kwargs):
         """Tensor pop."""
-        assert tensor_tag in self.tensor_tag_to_state
-        state = self.tensor_tag_to_state.pop(tensor_tag)
-        if isinstance(state, tuple):
+        group_id, tensor_id = tensor_tag
+        states = self.tensor_group_states[group_id]
+        state = states[tensor_id]
+        assert state is not None
+        states[tensor_id] = None
+        if isinstance(state, tuple) and state[0].type == "cuda":
+            compute_stream = torch.cuda.current_stream()
+            # the host copy has to be complete before it is read back
+            self.h2d_stream.wait_stream(self.d2h_stream)
+            with torch.cuda.stream(self.h2d_stream):
+                # host buffers from get_cpu_buf_for_offloaded_tensor are pinned
+                tensor = SynchronizedGroupOffloadHandler.reload(state, non_blocking=True)
+            compute_stream.wait_stream(self.h2d_stream)
+            _record_stream(tensor, compute_stream)
+        elif isinstance(state, tuple):
             tensor = SynchronizedGroupOffloadHandler.reload(state)
         else:
             tensor = state
@@ -276,6 +371,8 @@ class AsyncDoubleBufferGroupOffloadHandler(SynchronizedGroupOffloadHandler):
         num_offload_group,  # must be <= actual number of groups (number of commits)
         num_prefetch_group=1,
         tensor_need_offloading_checker=(lambda t: True),
+        min_offload_bytes=1 << 20,
+        activation_offload_dtype=None,
         debug=False,
     ) -> None:
         super().__init__(
@@ -284,21 +381,49 @@ class AsyncDoubleBufferGroupOffloadHandler(SynchronizedGroupOffloadHandler):
             debug=debug,
         )
         self.num_prefetch_group = num_prefetch_group
+        # tensors smaller than this are cheaper to keep on device than to copy
+        self.min_offload_bytes = min_offload_bytes
+        # lower precision dtype that activations are offloaded in, if any; fp16
+        # is not supported since large fp32 activations would overflow to inf
+        if activation_offload_dtype not in (None, torch.bfloat16):
+            raise ValueError(
+                f"Unsupported dtype for offloading activations ({activation_offload_dtype})"
+            )
+        self.activation_offload_dtype = activation_offload_dtype
+
+        # tags of the tensors to be bulk offloaded, indexed by group
+        self.tensor_tags_by_group = {}
+        # tags of the offloaded tensors to be bulk reloaded, indexed by group:
+        # plain tensors with (device, view of packed cpu buffer, dtype) states
+        # and Float8 tensors with (device, cpu copy) states
+        self.packed_tensor_tags_by_group = {}
+        self.fp8_tensor_tags_by_group = {}
+
+        # pinned host buffers for the packed tensors of each group, by dtype
+        self.group_dtype_to_cpu_buf = {}
+
+        # device buffers of the tensors saved in the current group, keyed by the
+        # memory they view, so that saving the same view again reuses the buffer
+        self.tensor_view_to_tensor_buf = {}
 
         # prepare for tensor buffer
         self.tensor_id_to_tensor_buf_double_bufs = []
         for _ in range(2):
             self.tensor_id_to_tensor_buf_double_bufs.append({})
 
-        # allocate streams and events for synchronization
-        self.d2h_stream = torch.cuda.Stream()
-        self.h2d_stream = torch.cuda.Stream()
+        # allocate events for synchronization
         self.h2d_finish_events = []
         self.compute_stream_bwd_start_events = []
+        self.d2h_finish_events = []
+        self.compute_stream_fwd_commit_events = []
         for _ in range(self.num_offload_group):
             self.h2d_finish_events.append(torch.cuda.Event())
             self.compute_stream_bwd_start_events.append(torch.cuda.Event())
-        self.d2h_final_event = torch.cuda.Event()
+            self.d2h_finish_events.append(torch.cuda.Event())
+            self.compute_stream_fwd_commit_events.append(torch.cuda.Event())
+        # D2H copies the compute stream has to wait for before it writes to each
+        # of the ping-pong buffers again
+        self.tensor_buf_free_events = [None, None]
 
     def get_tensor_buf_for_offloaded_tensor(self, tensor, tensor_tag):
         """Get tensor buffer for offloaded tensor."""
@@ -331,6 +456,39 @@ class AsyncDoubleBufferGroupOffloadHandler(SynchronizedGroupOffloadHandler):
 
         return id_buf_map[tensor_id]
 
+    def get_cpu_buf_for_packed_tensors(self, group_id, dtype, numel):
+        """Get pinned host buffer for the packed tensors of a group."""
+        cpu_buf = self.group_dtype_to_cpu_buf.get((group_id, dtype))
+        if cpu_buf is None or cpu_buf.numel() < numel:
+            # supposed to only execute once per group and dtype
+            cpu_buf = torch.empty(numel, dtype=dtype, device="cpu", pin_memory=True)
+            self.group_dtype_to_cpu_buf[(group_id, dtype)] = cpu_buf
+        return cpu_buf[:numel]
+
+    @staticmethod
+    def get_tensor_view_key(tensor):
+        """Get key identifying the memory viewed by a tensor."""
+        if isinstance(tensor, Float8Tensor):
+            # FP8 weights are saved as the same Float8Tensor object
+            return (id(tensor), tensor._data._version)
+        return (
+            tensor.untyped_storage().data_ptr(),
+            tensor.storage_offset(),
+            tensor.size(),
+            tensor.stride(),
+            tensor.dtype,
+            tensor._version,
+        )
+
+    def get_tensor_buf_for_aliased_tensor(self, tensor):
+        """Get tensor buffer of a previously saved tensor with the same view, if any."""
+        entry = self.tensor_view_to_tensor_buf.get(self.get_tensor_view_key(tensor))
+        # the key is only valid while the tensor it was taken from is alive,
+        # since its memory could otherwise have been reused
+        if entry is None or entry[0]() is None:
+            return None
+        return entry[1]
+
     def tensor_push(self, tensor: torch.Tensor, **kwargs) -> Any:
 
         torch_stray_tensor = isinstance(
@@ -343,36 +501,55 @@ class AsyncDoubleBufferGroupOffloadHandler(SynchronizedGroupOffloadHandler):
 
         if not torch_stray_tensor:
             # obtain a unique tensor tag
-            tensor_tag = (self.current_group, self.tensor_count_current_group)
-            self.tensor_count_current_group += 1
-            assert tensor_tag not in self.tensor_tag_to_state
-
-            if self.current_group < self.num_offload_group and self.tensor_need_offloading_checker(
-                tensor
+            tensor_tag = self.get_new_tensor_tag()
+            states = self.tensor_group_states[self.current_group]
+
+            if (
+                self.current_group < self.num_offload_group
+                and tensor.is_cuda
+                and tensor.numel() * tensor.element_size() >= self.min_offload_bytes
+                and self.tensor_need_offloading_checker(tensor)
             ):
-                # first copy the tensor to tensorbuf,
-                # so that the original tensor will not be deleted
-                tensor_buf = self.get_tensor_buf_for_offloaded_tensor(tensor, tensor_tag)
-                tensor_buf.copy_(tensor)
-                if hasattr(tensor, "weight_offloading"):
-                    tensor_buf.weight_offloading = True
-                if hasattr(tensor, "activation_offloading"):
-                    tensor_buf.activation_offloading = True
+                tensor_buf = self.get_tensor_buf_for_aliased_tensor(tensor)
+                if tensor_buf is None:
+                    # the previous contents of the buffer must have been offloaded
+                    buf_free_event = self.tensor_buf_free_events[self.current_group % 2]
+                    if buf_free_event is not None:
+                        torch.cuda.current_stream().wait_event(buf_free_event)
+                        self.tensor_buf_free_events[self.current_group % 2] = None
+                    # first copy the tensor to tensorbuf,
+                    # so that the original tensor will not be deleted
+                    tensor_buf = self.get_tensor_buf_for_offloaded_tensor(tensor, tensor_tag)
+                    tensor_buf.copy_(tensor)
+                    if hasattr(tensor, "weight_offloading"):
+                        tensor_buf.weight_offloading = True
+                    if hasattr(tensor, "activation_offloading"):
+                        tensor_buf.activation_offloading = True
+                    self.tensor_view_to_tensor_buf[self.get_tensor_view_key(tensor)] = (
+                        weakref.ref(tensor),
+                        tensor_buf,
+                    )
                 # Here we just save it, and at commit, bulk_offload_group will handle it
-                self.tensor_tag_to_state[tensor_tag] = tensor_buf
+                states.append(tensor_buf)
+                self.tensor_tags_by_group.setdefault(self.current_group, []).append(tensor_tag)
             else:
-                self.tensor_tag_to_state[tensor_tag] = tensor
+                states.append(tensor)
         else:
             tensor_tag = (-1, self.torch_tensor_count)
             self.torch_tensor_count += 1
-            self.tensor_tag_to_state[tensor_tag] = tensor
+            self.stray_tensor_tag_to_state[tensor_tag] = tensor
 
         return tensor_tag
 
     def tensor_pop(self, tensor_tag, **kwargs):
         """Tensor pop."""
-        assert tensor_tag in self.tensor_tag_to_state
-        tensor = self.tensor_tag_to_state.pop(tensor_tag)
+        group_id, tensor_id = tensor_tag
+        if group_id < 0:
+            return self.stray_tensor_tag_to_state.pop(tensor_tag)
+        states = self.tensor_group_states[group_id]
+        tensor = states[tensor_id]
+        assert tensor is not None
+        states[tensor_id] = None
         # the tensor should have been copied back in on_group_commit_backward()
         # which invokes bulk_reload_group.
         assert not isinstance(tensor, tuple)
@@ -380,67 +557,189 @@ class AsyncDoubleBufferGroupOffloadHandler(SynchronizedGroupOffloadHandler):
 
     def bulk_offload_group(self, group_to_offload):
         """Bulk offload group."""
+        tensor_tags = self.tensor_tags_by_group.pop(group_to_offload, None)
+        if not tensor_tags:
+            return
+        states = self.tensor_group_states[group_to_offload]
+        packed_tags = self.packed_tensor_tags_by_group.setdefault(group_to_offload, [])
+        fp8_tags = self.fp8_tensor_tags_by_group.setdefault(group_to_offload, [])
         with torch.cuda.stream(self.d2h_stream):
-            for tensor_tag, state in self.tensor_tag_to_state.items():
-                group_id, _ = tensor_tag
-                if group_id == group_to_offload:
-                    assert not isinstance(state, tuple)
-                    tensor_on_device = state
-
-                    # if offload, return the reference to cpu copy
-                    if self.tensor_need_offloading_checker(tensor_on_device):
-                        if hasattr(tensor_on_device, "weight_offloading"):
-                            delattr(tensor_on_device, "weight_offloading")
-                        if hasattr(tensor_on_device, "activation_offloading"):
-                            delattr(tensor_on_device, "activation_offloading")
-                        state = SynchronizedGroupOffloadHandler.offload(tensor_on_device)
-                        self.tensor_tag_to_state[tensor_tag] = state
-
-    def synchronize_on_group_commit_forward(self, current_group):
+            # plain tensors are packed by dtype into pooled pinned host buffers
+            tensors_to_pack = {}
+            # tags sharing a tensor buffer also share its offloaded state
+            buf_id_to_tag, aliased_tags = {}, []
+            offloaded_tag_lists = {}
+            for tensor_tag in tensor_tags:
+                state = states[tensor_tag[1]]
+                assert not isinstance(state, tuple)
+                tensor_on_device = state
+                if id(tensor_on_device) in buf_id_to_tag:
+                    aliased_tags.append((tensor_tag, buf_id_to_tag[id(tensor_on_device)]))
+                    continue
+                buf_id_to_tag[id(tensor_on_device)] = tensor_tag
+
+                # if offload, return the reference to cpu copy
+                if self.tensor_need_offloading_checker(tensor_on_device):
+                    is_activation = hasattr(tensor_on_device, "activation_offloading")
+                    if hasattr(tensor_on_device, "weight_offloading"):
+                        delattr(tensor_on_device, "weight_offloading")
+                    if hasattr(tensor_on_device, "activation_offloading"):
+                        delattr(tensor_on_device, "activation_offloading")
+                    if not isinstance(tensor_on_device, Float8Tensor):
+                        offload_dtype = tensor_on_device.dtype
+                        if (
+                            is_activation
+                            and self.activation_offload_dtype is not None
+                            and tensor_on_device.is_floating_point()
+                            and tensor_on_device.element_size() > 2  # wider than 16 bits
+                            # keep fp32 normalization statistics (mu, rsigma) exact
+                            and tensor_on_device.dim() > 1
+                        ):
+                            # fewer bytes sent over PCIe, at a loss of precision
+                            offload_dtype = self.activation_offload_dtype
+                        tensors_to_pack.setdefault(offload_dtype, []).append(
+                            (tensor_tag, tensor_on_device)
+                        )
+                        packed_tags.append(tensor_tag)
+                        offloaded_tag_lists[tensor_tag] = packed_tags
+                        continue
+                    cpu_buf = self.get_cpu_buf_for_offloaded_tensor(tensor_on_device, tensor_tag)
+                    state = SynchronizedGroupOffloadHandler.offload(
+                        tensor_on_device, cpu_buf=cpu_buf
+                    )
+                    _record_stream(tensor_on_device, self.d2h_stream)
+                    states[tensor_tag[1]] = state
+                    fp8_tags.append(tensor_tag)
+                    offloaded_tag_lists[tensor_tag] = fp8_tags
+
+            # each tensor is copied from its own buffer into an aligned slice of
+            # the pinned buffer of its dtype, without staging them on the device
+            src_tensors, dst_cpu_views = [], []
+            for dtype, tagged_tensors in tensors_to_pack.items():
+                alignment = _HOST_BUF_ALIGNMENT // torch.empty((), dtype=dtype).element_size()
+                offsets, numel = [], 0
+                for _, tensor in tagged_tensors:
+                    offsets.append(numel)
+                    numel += (tensor.numel() + alignment - 1) // alignment * alignment
+                cpu_buf = self.get_cpu_buf_for_packed_tensors(group_to_offload, dtype, numel)
+                for (tensor_tag, tensor), offset in zip(tagged_tensors, offsets):
+                    cpu_view = cpu_buf[offset : offset + tensor.numel()].view(tensor.size())
+                    # the buffer may be freed before the copy below is done
+                    _record_stream(tensor, self.d2h_stream)
+                    src_tensors.append(tensor if tensor.dtype == dtype else tensor.to(dtype))
+                    dst_cpu_views.append(cpu_view)
+                    # (device, view of packed cpu buffer, dtype) of the tensor
+                    states[tensor_tag[1]] = (tensor.device, cpu_view, tensor.dtype)
+
+            if src_tensors:
+                torch._foreach_copy_(dst_cpu_views, src_tensors, non_blocking=True)
+
+            for tensor_tag, source_tag in aliased_tags:
+                states[tensor_tag[1]] = states[source_tag[1]]
+                if source_tag in offloaded_tag_lists:
+                    offloaded_tag_lists[source_tag].append(tensor_tag)
+
+    def get_compute_stream(self):
+        """Get the compute stream, must be called outside of any side stream context."""
+        # inside a `torch.cuda.stream(s)` context, current_stream() returns `s`;
+        # synchronizing on it instead of the compute stream silently races the
+        # copies with the computation, so it is only looked up once per commit
+        compute_stream = torch.cuda.current_stream()
+        if self.debug:
+            assert compute_stream not in (self.d2h_stream, self.h2d_stream)
+        return compute_stream
+
+    def synchronize_on_group_commit_forward(self, current_group, compute_stream=None):
         """Synchronize on group commit forward."""
-        # the host should wait for the copying of previous group
-        # to avoid overwriting buffer
+        if compute_stream is None:
+            compute_stream = self.get_compute_stream()
+        # the buffers of previous group are written again by the next group,
+        # which has to wait for their copying to avoid overwriting them
         previous_group = current_group - 1
-        if previous_group < self.num_offload_group:
-            torch.cuda.synchronize()
-            # TODO (guyueh): this part is originally designed to reduce the peak memory usage. # pylint: disable=fixme
-            # however, uncommenting this part will cause illegal access, have not figured out why.
-
+        if 0 <= previous_group < self.num_offload_group:
             if previous_group + 2 >= self.num_offload_group:
-                # this buffer is no longer required
+                # this buffer is no longer required, the caching allocator keeps
+                # its memory until the copying is done since it was recorded on
+                # the d2h stream
                 self.tensor_id_to_tensor_buf_double_bufs[(previous_group % 2)] = {}
+            else:
+                # wait lazily, when the next group first writes to the buffer
+                d2h_finish_event = self.d2h_finish_events[previous_group]
+                self.tensor_buf_free_events[(previous_group % 2)] = d2h_finish_event
 
         # the copying of this group should wait for the computation stream event
         if current_group < self.num_offload_group:
+            compute_stream_event = self.compute_stream_fwd_commit_events[current_group]
+            compute_stream.record_event(compute_stream_event)
+            self.d2h_stream.wait_event(compute_stream_event)
             # perform bulk offloading
             self.bulk_offload_group(current_group)
-            if current_group == self.num_offload_group - 1:
-                self.d2h_stream.record_event(self.d2h_final_event)
+            self.d2h_stream.record_event(self.d2h_finish_events[current_group])
 
     def on_group_commit_forward(self):
-        """This function will cause host device synchronization"""
+        """On group commit forward."""
         # handle synchronization events
-        self.synchronize_on_group_commit_forward(self.current_group)
+        self.synchronize_on_group_commit_forward(self.current_group, self.get_compute_stream())
 
         # during forward, the next_group_to_fetch always points to the min of
         # the last commited group, and the last offloaded group
         self.next_group_to_fetch = min(self.current_group, self.num_offload_group - 1)
 
+        # views are only de-duplicated within a group
+        self.tensor_view_to_tensor_buf = {}
+
         super().on_group_commit_forward()
 
-    def bulk_reload_group(self, group_to_reload):
+    def bulk_reload_group(self, group_to_reload, compute_stream=None):
         """Bulk reload group."""
         assert group_to_reload < self.num_offload_group
-        if group_to_reload == self.num_offload_group - 1:
-            self.h2d_stream.wait_event(self.d2h_final_event)
+        self.h2d_stream.wait_event(self.d2h_finish_events[group_to_reload])
+        packed_tags = self.packed_tensor_tags_by_group.pop(group_to_reload, [])
+        fp8_tags = self.fp8_tensor_tags_by_group.pop(group_to_reload, [])
+        if not packed_tags and not fp8_tags:
+            return
+        states = self.tensor_group_states[group_to_reload]
+        if compute_stream is None:
+            compute_stream = self.get_compute_stream()
         with torch.cuda.stream(self.h2d_stream):
-            # move back tensors
-            for tensor_label, state in self.tensor_tag_to_state.items():
-                group_id, _ = tensor_label
-                if group_id == group_to_reload:
-                    if isinstance(state, tuple):
-                        recovered_tensor = SynchronizedGroupOffloadHandler.reload(state)
-                        self.tensor_tag_to_state[tensor_label] = recovered_tensor
+            # move back the plain tensors of the group all at once, each into its
+            # own allocation so that it can be freed as soon as backward is done with it
+            reloaded_states = {}
+            dst_tensors, src_cpu_views = [], []
+            for tensor_label in packed_tags:
+                state = states[tensor_label[1]]
+                if id(state) not in reloaded_states:
+                    dev, cpu_view, _ = state
+                    recovered_tensor = torch.empty_like(cpu_view, device=dev)
+                    dst_tensors.append(recovered_tensor)
+                    src_cpu_views.append(cpu_view)
+                    reloaded_states[id(state)] = recovered_tensor
+            if dst_tensors:
+                torch._foreach_copy_(dst_tensors, src_cpu_views, non_blocking=True)
+
+            # tags sharing an offloaded state also share the reloaded tensor
+            for tensor_label in packed_tags:
+                state = states[tensor_label[1]]
+                recovered_tensor = reloaded_states[id(state)]
+                if recovered_tensor.dtype != state[2]:
+                    recovered_tensor = recovered_tensor.to(state[2])
+                    reloaded_states[id(state)] = recovered_tensor
+                states[tensor_label[1]] = recovered_tensor
+            for recovered_tensor in reloaded_states.values():
+                # allocated on the h2d stream but consumed by backward compute
+                _record_stream(recovered_tensor, compute_stream)
+
+            for tensor_label in fp8_tags:
+                state = states[tensor_label[1]]
+                recovered_tensor = reloaded_states.get(id(state))
+                if recovered_tensor is None:
+                    recovered_tensor = SynchronizedGroupOffloadHandler.reload(
+                        state, non_blocking=True
+                    )
+                    # allocated on the h2d stream but consumed by backward compute
+                    _record_stream(recovered_tensor, compute_stream)
+                    reloaded_states[id(state)] = recovered_tensor
+                states[tensor_label[1]] = recovered_tensor
 
     def on_group_commit_backward(self):
         # first decrement the current group.
@@ -448,6 +747,7 @@ class AsyncDoubleBufferGroupOffloadHandler(SynchronizedGroupOffloadHandler):
         # Finally it should be decremented to 0.
         self.current_group -= 1
         assert self.current_group >= 0
+        compute_stream = self.get_compute_stream()
 
         # decide the range of group to prefetch
         should_prefetch_until_group = self.current_group - self.num_prefetch_group
@@ -458,15 +758,13 @@ class AsyncDoubleBufferGroupOffloadHandler(SynchronizedGroupOffloadHandler):
             self.next_group_to_fetch, should_prefetch_until_group - 1, -1
         ):
             # record the event in the compute stream, for h2d to wait
-            torch.cuda.current_stream().record_event(
-                self.compute_stream_bwd_start_events[group_num_to_prefetch]
-            )
+            compute_stream.record_event(self.compute_stream_bwd_start_events[group_num_to_prefetch])
 
             # start of h2d should wait for the compute and the d2h
             self.h2d_stream.wait_event(self.compute_stream_bwd_start_events[group_num_to_prefetch])
 
             # recover tensors (copy back from host)
-            self.bulk_reload_group(group_num_to_prefetch)
+            self.bulk_reload_group(group_num_to_prefetch, compute_stream)
 
             # record an event for the backward of this layer to wait
             self.h2d_stream.record_event(self.h2d_finish_events[group_num_to_prefetch])
@@ -476,7 +774,7 @@ class AsyncDoubleBufferGroupOffloadHandler(SynchronizedGroupOffloadHandler):
 
         # wait for the current group
         if self.current_group < self.num_offload_group:
-            torch.cuda.current_stream().wait_event(self.h2d_finish_events[self.current_group])
+            compute_stream.wait_event(self.h2d_finish_events[self.current_group])
 
 
 def get_cpu_offload_context(
@@ -484,6 +782,9 @@ def get_cpu_offload_context(
     num_layers: int = 1,
     offload_activations: bool = True,
     offload_weights: bool = True,
+    num_prefetch_layers: int = 1,
+    activation_offload_dtype: Optional[torch.dtype] = None,
+    min_offload_bytes: int = 1 << 20,
 ):
     """
     This function returns the CPU Offload context and the synchronizer function that needs to be
@@ -510,6 +811,20 @@ def get_cpu_offload_context(
                          When set to `True`, offloads the activations for the TE layer.
     offload_weights: bool, default = `True`
                      When set to `True`, offloads the weights for the TE layer.
+    num_prefetch_layers: int, default = 1
+                         Number of layers, besides the one starting its backward pass,
+                         whose offloaded tensors are reloaded ahead of time. Larger values
+                         hide more host-to-device copying at the cost of device memory.
+    activation_offload_dtype: torch.dtype, default = `None`
+                              When set to `torch.bfloat16`, activations in a wider floating
+                              point dtype are cast to it before they are offloaded and cast
+                              back after they are reloaded. This reduces host-device traffic
+                              at the cost of precision in the backward pass. 1-D tensors,
+                              such as normalization statistics, are offloaded unchanged.
+    min_offload_bytes: int, default = 1048576
+                       Tensors smaller than this many bytes are kept on the device, since
+                       copying them costs more than the memory they take up. Set to 0 to
+                       offload every tensor selected for offloading.
 
     """
 
@@ -535,10 +850,15 @@ def get_cpu_offload_context(
             "mentioned what to offload (weights/activations)"
         )
 
+    if num_prefetch_layers < 1:
+        raise ValueError("CPU Offloading needs to prefetch at least one layer")
+
     cpu_offload_handler = AsyncDoubleBufferGroupOffloadHandler(
         num_offload_group=num_layers,
-        num_prefetch_group=1,
+        num_prefetch_group=num_prefetch_layers,
         tensor_need_offloading_checker=tensor_need_offloading_checker,
+        min_offload_bytes=min_offload_bytes,
+        activation_offload_dtype=activation_offload_dtype,
     )
 
     def group_prefetch_offload_commit_async(tensor):
@@ -494,7 +494,7 @@ class Float8Tensor(torch.Tensor):
             "Float8Tensor("
             f"fp8_dtype={self._fp8_dtype}, "
             f"scale_inv={self._scale_inv.item()}, "
-            f"data={self.from_float8(dtype=self.dtype)}"
+            f"data={_FromFloat8Func.forward(None, self, self.dtype)}"
             ")"
         )
 
@@ -550,14 +550,16 @@ class TransformerEngineBaseModule(torch.nn.Module, ABC):
 
         if self.fp8 or self.fp8_calibration:
             # FP8 init has already been run and recipe is the same, don't do anything.
-            if (
-                self.fp8_initialized
-                and FP8GlobalStateManager.get_fp8_recipe() == self.fp8_meta["recipe"]
+            # The recipe object is usually reused across iterations, so check identity
+            # before falling back to the field-by-field dataclass comparison.
+            fp8_recipe = FP8GlobalStateManager.get_fp8_recipe()
+            if self.fp8_initialized and (
+                fp8_recipe is self.fp8_meta["recipe"] or fp8_recipe == self.fp8_meta["recipe"]
             ):
                 return
 
             # Set FP8, recipe, and other FP8 metadata
-            self.fp8_meta["recipe"] = FP8GlobalStateManager.get_fp8_recipe()
+            self.fp8_meta["recipe"] = fp8_recipe
             self.fp8_meta["num_gemms"] = num_gemms
             self.fp8_meta["fp8_group"] = FP8GlobalStateManager.get_fp8_group()
 